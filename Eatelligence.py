@@ -2,26 +2,77 @@ import streamlit as st
 import cv2
 from pyzbar import pyzbar
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
-from typing import Dict, List, Optional, Union
+import pandas as pd
+from PIL import Image
+import io
+import functools
+import hashlib
+import html
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Union
+from collections import OrderedDict, deque
+import queue
+import heapq
+import threading
 import time
-from geopy.geocoders import Nominatim
 import json
 import google.generativeai as genai
 
+# Retail product barcodes only; skipping other symbologies shortens zbar's scan
+PYZBAR_SYMBOLS = [
+    pyzbar.ZBarSymbol.EAN13, pyzbar.ZBarSymbol.UPCA,
+    pyzbar.ZBarSymbol.EAN8, pyzbar.ZBarSymbol.UPCE
+]
+
+try:
+    # orjson parses Open Food Facts payloads several times faster than json
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    # Optional: zxing-cpp's SIMD decoder is the fastest option when installed
+    import zxingcpp
+    ZXING_FORMATS = (
+        zxingcpp.BarcodeFormat.EAN13 | zxingcpp.BarcodeFormat.UPCA
+        | zxingcpp.BarcodeFormat.EAN8 | zxingcpp.BarcodeFormat.UPCE
+    )
+except ImportError:
+    zxingcpp = None
+
+try:
+    # Optional: persists lookups across restarts; without it only the
+    # in-process Streamlit caches are used
+    import diskcache
+except ImportError:
+    diskcache = None
+
 # Initialize Gemini API key
 GEMINI_API_KEY = ""  # Leave empty for user to fill (User must create a free API key for gemini by google and use it here)
+# Alias that follows Google's current Flash release (supports response_schema
+# and streaming); pin a versioned id such as "gemini-2.5-flash" if needed
+GEMINI_MODEL = "gemini-flash-latest"
 
-class StoreFinder:
-    """Handles finding healthy food stores using Gemini AI"""
-    def __init__(self):
-        # Configure Gemini AI
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-pro')
+OFF_PRODUCT_URL = "https://world.openfoodfacts.org/api/v2/product/"
+OFF_SEARCH_URL = "https://world.openfoodfacts.org/api/v2/search"
+
+# Only request the fields the app reads; full product records are far larger
+OFF_PRODUCT_FIELDS = "code,product_name,brands,categories_tags,nutriments"
+OFF_SEARCH_FIELDS = "code,product_name,brands,nutriments,serving_size"
 
-    def find_stores(self, product_name: str) -> List[Dict]:
-        """Find stores that might carry healthier alternatives using Gemini AI"""
-        prompt = f"""
+# Open Food Facts' published limits as (requests, seconds)
+OFF_PRODUCT_RATE = (100, 60)
+OFF_SEARCH_RATE = (10, 60)
+
+GEMINI_TEMPERATURES = (0.2, 0.7)  # Concurrent store requests, first to produce a store wins
+GEMINI_TIMEOUT = 8  # Seconds to wait for the next store before giving up
+
+STORES_PROMPT = """
         Suggest 5 common stores that typically carry healthier alternatives to {product_name}.
         Focus on:
         - Health food stores
@@ -43,46 +94,348 @@ class StoreFinder:
         
         Keep descriptions concise but informative.
         """
-        
+
+# Gemini constrains its output to this schema, so the answer is always valid JSON
+STORES_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "name": {"type": "STRING"},
+            "description": {"type": "STRING"},
+            "healthy_alternatives": {"type": "STRING"},
+            "special_features": {"type": "STRING"}
+        },
+        "required": ["name", "description", "healthy_alternatives", "special_features"]
+    }
+}
+
+@st.cache_resource(show_spinner=False)
+def _get_session() -> requests.Session:
+    """Shared HTTP session, so repeat Open Food Facts calls reuse pooled keep-alive connections"""
+    session = requests.Session()
+    session.headers["User-Agent"] = "Eatelligence/1.0"
+    session.mount("https://", HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True
+        )
+    ))
+    return session
+
+@st.cache_resource(show_spinner=False)
+def _disk_cache() -> Optional["diskcache.Cache"]:
+    """On-disk cache, so previously scanned products survive app restarts (None without diskcache)"""
+    if diskcache is None:
+        return None
+    return diskcache.Cache(os.path.join(tempfile.gettempdir(), "eatelligence"), size_limit=256 << 20)
+
+@st.cache_resource(show_spinner=False)
+def _preconnect() -> threading.Thread:
+    """Open a pooled connection to Open Food Facts in the background when the app starts"""
+    # Resolve the cached session here on the script thread; cached factories
+    # need its ScriptRunContext, which the warm-up thread doesn't have
+    session = _get_session()
+
+    def warm():
         try:
-            response = self.model.generate_content(prompt)
-            stores_text = response.text
-            
-            # Extract JSON from response
-            stores_str = stores_text[stores_text.find('['):stores_text.rfind(']')+1]
-            stores = json.loads(stores_str)
-            
-            return stores
-            
-        except Exception as e:
-            st.error(f"Error generating store recommendations: {str(e)}")
-            return []
+            session.head("https://world.openfoodfacts.org/", timeout=(3, 10))
+        except requests.RequestException:
+            pass  # Only a warm-up; the first real lookup will connect on its own
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+class _RateLimiter:
+    """Sliding-window limit of `calls` requests per `period` seconds, shared by all sessions"""
+    def __init__(self, calls: int, period: float):
+        self.calls = calls
+        self.period = period
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until another request is allowed, then record it"""
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] >= self.period:
+                self._sent.popleft()
+            if len(self._sent) >= self.calls:
+                time.sleep(self.period - (now - self._sent.popleft()))
+                now = time.monotonic()
+            self._sent.append(now)
+
+@st.cache_resource(show_spinner=False)
+def _rate_limiter(calls: int, period: float) -> _RateLimiter:
+    """One limiter per budget, shared across reruns and sessions"""
+    return _RateLimiter(calls, period)
+
+def _off_get(url: str, params: Dict, limiter: _RateLimiter) -> requests.Response:
+    """GET from Open Food Facts without exceeding its published rate limits"""
+    limiter.wait()
+    response = _get_session().get(url, params=params, timeout=(3, 10))
+    response.raise_for_status()
+    return response
+
+# Streamlit reruns this whole script on every widget interaction, so the
+# external lookups live at module level where st.cache_data can key them on
+# their arguments and share the results across reruns and sessions.
+@st.cache_data(ttl=86400, max_entries=2048, show_spinner=False)
+def _fetch_product(barcode: str) -> Optional[Dict]:
+    """Fetch a product record from Open Food Facts (cached per barcode)"""
+    cache = _disk_cache()
+    product = cache.get(barcode) if cache is not None else None
+    if product is not None:
+        return product
+
+    try:
+        response = _off_get(
+            f"{OFF_PRODUCT_URL}{barcode}.json", {'fields': OFF_PRODUCT_FIELDS}, _rate_limiter(*OFF_PRODUCT_RATE)
+        )
+    except requests.HTTPError as e:
+        # Unknown barcodes come back as 404 with a status 0 body; report them
+        # as not found so the miss is cached instead of retried every rerun
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+    data = _json_loads(response.content)
+    if data.get('status') == 1:
+        if cache is not None:
+            cache.set(barcode, data['product'], expire=7 * 86400)
+        return data['product']
+    return None
+
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
+def _search_alternatives(main_category: str) -> List[Dict]:
+    """Search US products in a category with a Nutri-Score of A or B (cached per category)"""
+    cache = _disk_cache()
+    key = ('search', main_category)
+    products = cache.get(key) if cache is not None else None
+    if products is not None:
+        return products
+
+    # Country and grade are filtered server-side so we never download products we'd discard
+    params = {
+        'categories_tags': main_category,
+        'countries_tags_en': 'united-states',
+        'nutrition_grades_tags': 'a|b',
+        'sort_by': 'nutriscore_score',
+        'page_size': 30,
+        'fields': OFF_SEARCH_FIELDS
+    }
+    response = _off_get(OFF_SEARCH_URL, params, _rate_limiter(*OFF_SEARCH_RATE))
+    products = _json_loads(response.content).get('products', [])
+    if cache is not None:
+        cache.set(key, products, expire=86400)
+    return products
+
+@st.cache_resource(show_spinner=False)
+def _get_model() -> genai.GenerativeModel:
+    """Configure the Gemini SDK once per process and share one model across reruns"""
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+class _LRUCache:
+    """Small thread-safe LRU map, shared by every Streamlit session when cached as a resource"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def _store_cache() -> _LRUCache:
+    """Finished Gemini store lists keyed by normalized product name"""
+    return _LRUCache(maxsize=512)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def _pop_stores(buffer: str):
+    """Split the complete store objects off the front of a partially streamed JSON array"""
+    stores = []
+    pos = 0
+    while True:
+        start = buffer.find('{', pos)
+        if start == -1:
+            return stores, buffer[pos:]
+        try:
+            store, pos = _JSON_DECODER.raw_decode(buffer, start)
+        except json.JSONDecodeError:
+            # Object still incomplete, keep it for the next chunk
+            return stores, buffer[start:]
+        stores.append(store)
+
+def _stream_stores(model: genai.GenerativeModel, product_name: str, temperature: float,
+                   results: queue.Queue, stop: threading.Event, racer: int):
+    """Stream one Gemini answer, queueing each store as soon as its object is complete"""
+    try:
+        response = model.generate_content(
+            STORES_PROMPT.format(product_name=product_name),
+            generation_config={
+                "temperature": temperature,
+                "response_mime_type": "application/json",
+                "response_schema": STORES_SCHEMA
+            },
+            stream=True
+        )
+        buffer = ""
+        for chunk in response:
+            if stop.is_set():
+                return
+            buffer += chunk.text
+            stores, buffer = _pop_stores(buffer)
+            for store in stores:
+                results.put((racer, store))
+    except Exception as e:
+        results.put((racer, e))
+    finally:
+        # None marks the end of this racer's stream
+        results.put((racer, None))
+
+def _race_gemini_stores(model: genai.GenerativeModel, product_name: str) -> Iterator[Dict]:
+    """Yield stores from whichever concurrent Gemini stream produces one first
+
+    The other streams are told to stop once a winner is picked. Raises
+    TimeoutError if no store arrives for GEMINI_TIMEOUT seconds.
+    """
+    results = queue.Queue()
+    stops = [threading.Event() for _ in GEMINI_TEMPERATURES]
+    for racer, temperature in enumerate(GEMINI_TEMPERATURES):
+        threading.Thread(
+            target=_stream_stores,
+            args=(model, product_name, temperature, results, stops[racer], racer),
+            daemon=True
+        ).start()
+
+    winner = None
+    finished = 0
+    error = None
+    try:
+        while True:
+            try:
+                racer, item = results.get(timeout=GEMINI_TIMEOUT)
+            except queue.Empty:
+                raise TimeoutError("Gemini did not respond in time")
+
+            if winner is not None and racer != winner:
+                continue
+            if item is None:
+                finished += 1
+                if racer == winner or finished == len(GEMINI_TEMPERATURES):
+                    if winner is None and error is not None:
+                        raise error
+                    return
+            elif isinstance(item, Exception):
+                if racer == winner:
+                    raise item
+                error = item
+            else:
+                if winner is None:
+                    winner = racer
+                    for other, stop in enumerate(stops):
+                        if other != winner:
+                            stop.set()
+                yield item
+    finally:
+        for stop in stops:
+            stop.set()
+
+def _to_float(value) -> float:
+    """Convert an Open Food Facts nutrient value to float, treating missing or bad values as 0"""
+    try:
+        return float(value or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+class StoreFinder:
+    """Handles finding healthy food stores using Gemini AI"""
+    def __init__(self):
+        self.model = _get_model()
+
+    def stream_stores(self, product_name: str) -> Iterator[Dict]:
+        """Yield stores that might carry healthier alternatives as Gemini generates them
+
+        Complete answers are cached, so repeat searches replay instantly.
+        """
+        key = product_name.strip().lower()
+        cache = _store_cache()
+        stores = cache.get(key)
+        if stores is not None:
+            yield from stores
+            return
+
+        stores = []
+        for store in _race_gemini_stores(self.model, key):
+            stores.append(store)
+            yield store
+        if stores:
+            cache.put(key, stores)
 
 class HealthyFoodScanner:
     def __init__(self):
-        self.api_url = "https://world.openfoodfacts.org/api/v0/product/"
-        self.search_url = "https://world.openfoodfacts.org/cgi/search.pl"
         self.store_finder = StoreFinder()
+
+        # zxing-cpp or OpenCV 4.8+ decode EAN/UPC in-process on the ndarray we
+        # already have; pyzbar stays as the fallback decoder. Older contrib
+        # builds ship cv2.barcode without detectAndDecodeWithType, so check
+        # for the method itself rather than the module
+        self._barcode_detector = None
+        if (zxingcpp is None and hasattr(cv2, 'barcode')
+                and hasattr(cv2.barcode.BarcodeDetector, 'detectAndDecodeWithType')):
+            self._barcode_detector = cv2.barcode.BarcodeDetector()
         
-        # Standard US nutrition facts order and units
+        # Standard US nutrition facts order, units, and the factor that converts
+        # Open Food Facts' per-100g gram values into the displayed unit
         self.nutrition_facts_order = [
-            ('energy-kcal_100g', 'Calories', 'kcal'),
-            ('fat_100g', 'Total Fat', 'g'),
-            ('saturated-fat_100g', '  Saturated Fat', 'g'),
-            ('trans-fat_100g', '  Trans Fat', 'g'),
-            ('cholesterol_100g', 'Cholesterol', 'mg'),
-            ('sodium_100g', 'Sodium', 'mg'),
-            ('carbohydrates_100g', 'Total Carbohydrates', 'g'),
-            ('fiber_100g', '  Dietary Fiber', 'g'),
-            ('sugars_100g', '  Sugars', 'g'),
-            ('proteins_100g', 'Protein', 'g'),
-            ('vitamin-d_100g', 'Vitamin D', 'µg'),
-            ('calcium_100g', 'Calcium', 'mg'),
-            ('iron_100g', 'Iron', 'mg'),
-            ('potassium_100g', 'Potassium', 'mg')
+            ('energy-kcal_100g', 'Calories', 'kcal', 1.0),
+            ('fat_100g', 'Total Fat', 'g', 1.0),
+            ('saturated-fat_100g', '  Saturated Fat', 'g', 1.0),
+            ('trans-fat_100g', '  Trans Fat', 'g', 1.0),
+            ('cholesterol_100g', 'Cholesterol', 'mg', 1000.0),
+            ('sodium_100g', 'Sodium', 'mg', 1000.0),
+            ('carbohydrates_100g', 'Total Carbohydrates', 'g', 1.0),
+            ('fiber_100g', '  Dietary Fiber', 'g', 1.0),
+            ('sugars_100g', '  Sugars', 'g', 1.0),
+            ('proteins_100g', 'Protein', 'g', 1.0),
+            ('vitamin-d_100g', 'Vitamin D', 'µg', 1e6),
+            ('calcium_100g', 'Calcium', 'mg', 1000.0),
+            ('iron_100g', 'Iron', 'mg', 1000.0),
+            ('potassium_100g', 'Potassium', 'mg', 1000.0)
         ]
 
+        # Health score weights per 100g, capped at 10 units of each nutrient
+        self._score_keys = (
+            'sugars_100g', 'saturated-fat_100g', 'sodium_100g', 'fat_100g',
+            'proteins_100g', 'fiber_100g', 'vitamin-d_100g', 'calcium_100g', 'iron_100g', 'potassium_100g'
+        )
+        weights = (-5, -5, -4, -3, 4, 4, 2, 2, 2, 2)
+        self._score_weights = np.array(weights, dtype=np.float64)
+        # Plain (key, weight) pairs for scoring a single product without NumPy overhead
+        self._score_terms = tuple(zip(self._score_keys, weights))
+        # The first six score keys are also compared against the scanned product:
+        # sugars, saturated fat, sodium and fat should go down, protein and fiber up
+        self._compare_signs = np.array([-1, -1, -1, -1, 1, 1], dtype=np.float64)
+
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def format_number(value: Union[float, int, str]) -> str:
         """Format number to 2 decimal places"""
         try:
@@ -90,40 +443,79 @@ class HealthyFoodScanner:
         except (ValueError, TypeError):
             return str(value)
 
+    @staticmethod
+    def decode_image(data: bytes):
+        """Decode camera image bytes straight to grayscale, at half resolution for large photos"""
+        # Image.open only parses the header here, so checking the size is cheap
+        with Image.open(io.BytesIO(data)) as header:
+            flag = cv2.IMREAD_REDUCED_GRAYSCALE_2 if max(header.size) > 1500 else cv2.IMREAD_GRAYSCALE
+        return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+    def nutrition_facts_df(self, nutrients: Dict) -> pd.DataFrame:
+        """Build a product's nutrition facts table, skipping missing and zero values"""
+        rows = []
+        for nutrient_key, label, unit, scale in self.nutrition_facts_order:
+            value = nutrients.get(nutrient_key)
+            if not value:
+                continue
+            try:
+                rows.append((label, f"{self.format_number(float(value) * scale)}{unit}"))
+            except (ValueError, TypeError):
+                continue
+        return pd.DataFrame(rows, columns=['Nutrient', 'Amount']).set_index('Nutrient')
+
     def process_frame(self, frame) -> Optional[str]:
         """Process a single frame to detect barcodes"""
         if frame is not None:
-            # Convert to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            # Convert to grayscale unless the frame was decoded that way already
+            gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            # Downscale large frames before any filtering; barcodes stay readable at 720px
+            scale = 720 / max(gray.shape)
+            if scale < 1:
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
             
-            # Try multiple processing methods
-            methods = [
-                gray,  # Original grayscale
-                cv2.equalizeHist(gray),  # Enhanced contrast
-                cv2.GaussianBlur(gray, (5, 5), 0),  # Blurred
-                cv2.adaptiveThreshold(
-                    gray, 255,
-                    cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                    cv2.THRESH_BINARY, 91, 11
+            # Try the raw grayscale first; only if that fails, binarize once
+            # against the local box mean (constant cost per pixel whatever
+            # the block size) instead of cycling through several filters
+            methods = (
+                lambda g: g,  # Original grayscale
+                lambda g: cv2.adaptiveThreshold(
+                    g, 255,
+                    cv2.ADAPTIVE_THRESH_MEAN_C,
+                    cv2.THRESH_BINARY, 31, 10
                 )  # Thresholded
-            ]
+            )
             
-            for processed in methods:
-                barcodes = pyzbar.decode(processed)
-                if barcodes:
-                    return barcodes[0].data.decode("utf-8")
+            for method in methods:
+                barcode = self._decode(method(gray))
+                if barcode:
+                    return barcode
                     
         return None
 
+    def _decode(self, image) -> Optional[str]:
+        """Decode the first barcode in an image, trying zxing-cpp or OpenCV before pyzbar"""
+        if zxingcpp is not None:
+            results = zxingcpp.read_barcodes(image, formats=ZXING_FORMATS)
+            if results:
+                return results[0].text
+        elif self._barcode_detector is not None:
+            ok, decoded, _, _ = self._barcode_detector.detectAndDecodeWithType(image)
+            if ok:
+                barcode = next((code for code in decoded if code), None)
+                if barcode:
+                    return barcode
+
+        barcodes = pyzbar.decode(image, symbols=PYZBAR_SYMBOLS)
+        if barcodes:
+            return barcodes[0].data.decode("utf-8")
+        return None
+
     def get_product_info(self, barcode: str) -> Optional[Dict]:
         """Fetch product information"""
         try:
-            response = requests.get(f"{self.api_url}{barcode}.json")
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('status') == 1:
-                    return data['product']
-            return None
+            return _fetch_product(barcode)
         except Exception as e:
             st.error(f"Error fetching product info: {e}")
             return None
@@ -133,60 +525,44 @@ class HealthyFoodScanner:
         categories = product_info.get('categories_tags', [])
         main_category = next((cat for cat in categories if cat), 'unknown')
         current_nutrients = product_info.get('nutriments', {})
+
+        # Without a known category or any nutrients to compare there is nothing
+        # to search for, so skip the network call entirely
+        if not main_category.startswith('en:'):
+            return []
+        if not any(key in current_nutrients for key in self._score_keys[:len(self._compare_signs)]):
+            return []
         
-        params = {
-            'action': 'process',
-            'tagtype_0': 'categories',
-            'tag_contains_0': 'contains',
-            'tag_0': main_category,
-            'tagtype_1': 'countries',
-            'tag_contains_1': 'contains',
-            'tag_1': 'united-states',
-            'sort_by': 'nutrition_grades',
-            'page_size': 100,
-            'json': 1
-        }
-        
-        alternatives = []
         try:
             with st.spinner('Searching for healthier alternatives...'):
-                response = requests.get(self.search_url, params=params)
-                if response.status_code == 200:
-                    products = response.json().get('products', [])
-                    
-                    for product in products:
-                        if product.get('code') == product_info.get('code'):
-                            continue
-                            
-                        alt_score = self.calculate_health_score(product)
-                        alt_nutrients = product.get('nutriments', {})
-                        
-                        countries = product.get('countries_tags', [])
-                        if 'en:united-states' not in countries:
-                            continue
-
-                        if alt_score > health_score:
-                            if self.is_healthier_option(current_nutrients, alt_nutrients):
-                                alternatives.append({
-                                    'name': product.get('product_name', 'Unknown'),
-                                    'brand': product.get('brands', 'Unknown Brand'),
-                                    'health_score': alt_score,
-                                    'nutriments': alt_nutrients,
-                                    'serving_size': product.get('serving_size', 'Not specified')
-                                })
-                    
-                    alternatives.sort(key=lambda x: x['health_score'], reverse=True)
-                    unique_alts = []
-                    seen = set()
-                    
-                    for alt in alternatives:
-                        if alt['name'] not in seen:
-                            seen.add(alt['name'])
-                            unique_alts.append(alt)
-                            if len(unique_alts) >= 3:
-                                break
-                    
-                    return unique_alts
+                products = _search_alternatives(main_category)
+
+            # Score and compare every candidate at once on one nutrient matrix
+            values, present = self._nutrient_matrix(products)
+            scores = self._score_values(values)
+            is_other = np.array([product.get('code') != product_info.get('code') for product in products], dtype=bool)
+            mask = is_other & (scores > health_score) & self._healthier_mask(current_nutrients, values, present)
+            candidates = np.flatnonzero(mask)
+            
+            # Keep the best-scoring entry per name and brand in one pass, then
+            # pick the top 3 with a bounded heap instead of sorting everything
+            best = {}
+            for i in candidates.tolist():
+                product = products[i]
+                key = (product.get('product_name', 'Unknown'), product.get('brands', 'Unknown Brand'))
+                if key not in best or scores[i] > scores[best[key]]:
+                    best[key] = i
+            
+            return [
+                {
+                    'name': name,
+                    'brand': brand,
+                    'health_score': float(scores[i]),
+                    'nutriments': products[i].get('nutriments', {}),
+                    'serving_size': products[i].get('serving_size', 'Not specified')
+                }
+                for (name, brand), i in heapq.nlargest(3, best.items(), key=lambda item: scores[item[1]])
+            ]
                     
         except Exception as e:
             st.error(f"Error finding alternatives: {e}")
@@ -194,67 +570,97 @@ class HealthyFoodScanner:
 
     def is_healthier_option(self, current_nutrients: Dict, alt_nutrients: Dict) -> bool:
         """Compare nutritional profiles"""
-        better_count = 0
-        total_comparisons = 0
-        
-        comparisons = {
-            'sugars_100g': '<',
-            'fat_100g': '<',
-            'saturated-fat_100g': '<',
-            'sodium_100g': '<',
-            'proteins_100g': '>',
-            'fiber_100g': '>'
-        }
-        
-        for nutrient, comparison in comparisons.items():
-            if nutrient in current_nutrients and nutrient in alt_nutrients:
-                current_val = float(current_nutrients[nutrient] or 0)
-                alt_val = float(alt_nutrients[nutrient] or 0)
-                
-                if comparison == '<' and alt_val < current_val:
-                    better_count += 1
-                elif comparison == '>' and alt_val > current_val:
-                    better_count += 1
-                total_comparisons += 1
-        
-        return total_comparisons > 0 and (better_count / total_comparisons) >= 0.6
+        values, present = self._nutrient_matrix([{'nutriments': alt_nutrients}])
+        return bool(self._healthier_mask(current_nutrients, values, present)[0])
+
+    def _healthier_mask(self, current_nutrients: Dict, values: np.ndarray, present: np.ndarray) -> np.ndarray:
+        """Flag rows that beat the current product on at least 60% of the nutrients both list"""
+        n = len(self._compare_signs)
+        current, current_present = self._nutrient_matrix([{'nutriments': current_nutrients}])
+        shared = present[:, :n] & current_present[:, :n]
+        better = (((values[:, :n] - current[:, :n]) * self._compare_signs) > 0) & shared
+        total = shared.sum(axis=1)
+        return (total > 0) & (better.sum(axis=1) / np.maximum(total, 1) >= 0.6)
+
+    def _nutrient_matrix(self, products: List[Dict]):
+        """Stack the scoring nutrients of each product into (N, 10) value and presence arrays"""
+        values = np.zeros((len(products), len(self._score_keys)), dtype=np.float64)
+        present = np.zeros((len(products), len(self._score_keys)), dtype=bool)
+        for i, product in enumerate(products):
+            nutrients = product.get('nutriments', {})
+            values[i] = [_to_float(nutrients.get(key)) for key in self._score_keys]
+            present[i] = [key in nutrients for key in self._score_keys]
+        return values, present
+
+    def _score_values(self, values: np.ndarray) -> np.ndarray:
+        """Calculate health scores (1-100) from rows of a nutrient matrix"""
+        # Add the terms column by column in the same order and precision as
+        # calculate_health_score, so a product scores identically on both paths
+        scores = np.full(len(values), 50.0)
+        for column, weight in enumerate(self._score_weights):
+            scores += weight * np.minimum(values[:, column], 10)
+        return np.clip(scores, 1.0, 100.0)
 
     def calculate_health_score(self, product_info: Dict) -> float:
         """Calculate health score (1-100)"""
-        score = 50.0
         nutrients = product_info.get('nutriments', {})
+        score = 50.0
+        for key, weight in self._score_terms:
+            score += weight * min(_to_float(nutrients.get(key)), 10)
+        return max(1.0, min(score, 100.0))
+
+@st.cache_resource(show_spinner=False)
+def get_scanner() -> HealthyFoodScanner:
+    """One scanner per process, so its detector and lookup tables survive reruns"""
+    return HealthyFoodScanner()
+
+# st.fragment graduated from st.experimental_fragment in Streamlit 1.37
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+@_fragment
+def render_store_search(scanner: HealthyFoodScanner):
+    """Render the stores tab; its widgets rerun just this fragment instead of the whole page"""
+    st.write("### Find Stores with Healthy Alternatives")
+    product_name = ""
+    
+    if st.session_state.product_info:
+        product_name = st.session_state.product_info.get('product_name', '')
+    else:
+        product_name = st.text_input("Enter a product to find alternatives for:", "")
+    
+    if product_name:
+        find_stores = st.button("Find Stores")
         
-        negative_factors = {
-            'sugars_100g': -5,
-            'saturated-fat_100g': -5,
-            'sodium_100g': -4,
-            'fat_100g': -3
-        }
-        
-        positive_factors = {
-            'proteins_100g': 4,
-            'fiber_100g': 4,
-            'vitamin-d_100g': 2,
-            'calcium_100g': 2,
-            'iron_100g': 2,
-            'potassium_100g': 2
-        }
-        
-        for nutrient, impact in negative_factors.items():
-            value = nutrients.get(nutrient, 0)
+        if find_stores:
+            # Render each store as soon as Gemini finishes describing it. The
+            # status is itself an expander and older Streamlit releases refuse
+            # nested expanders, so the store cards go in a container below it
+            status = st.status("🔍 Finding stores with healthy alternatives...", expanded=True)
+            cards = st.container()
             try:
-                score += impact * min(float(value), 10)
-            except (ValueError, TypeError):
-                continue
+                found = 0
+                for store in scanner.store_finder.stream_stores(product_name):
+                    with cards.expander(f"🏪 {store['name']}"):
+                        st.write(f"**Why this store:** {store['description']}")
+                        st.write("**Healthy Alternatives:**")
+                        st.write(store['healthy_alternatives'])
+                        st.write("**Special Features:**")
+                        st.write(store['special_features'])
+                    found += 1
+                
+                if found:
+                    status.update(label=f"Found {found} stores with healthy alternatives", state="complete")
+                else:
+                    status.update(label="No stores found", state="complete")
+                    status.info("No store recommendations available at the moment. Try again later.")
             
-        for nutrient, impact in positive_factors.items():
-            value = nutrients.get(nutrient, 0)
-            try:
-                score += impact * min(float(value), 10)
-            except (ValueError, TypeError):
-                continue
+            except TimeoutError:
+                status.update(label="Store search timed out", state="error")
+                status.error("The store search is taking too long. Please try again.")
             
-        return max(1.0, min(100.0, score))
+            except Exception as e:
+                status.update(label="Store search failed", state="error")
+                status.error(f"An error occurred while searching for stores: {str(e)}")
 
 def main():
     st.set_page_config(page_title="Healthy Food Scanner", page_icon="🥗", layout="wide")
@@ -262,7 +668,8 @@ def main():
     st.title("🥗 Eatelligence")
     st.write("Scan a product barcode to get health information and find healthier alternatives!")
 
-    scanner = HealthyFoodScanner()
+    scanner = get_scanner()
+    _preconnect()
 
     # Initialize session state
     if 'barcode_detected' not in st.session_state:
@@ -271,6 +678,9 @@ def main():
         st.session_state.product_info = None
     if 'show_stores' not in st.session_state:
         st.session_state.show_stores = False
+    if 'photo_digest' not in st.session_state:
+        st.session_state.photo_digest = None
+        st.session_state.barcode = None
 
     # Create tabs for different features
     scan_tab, stores_tab = st.tabs(["Scan Product", "Find Healthy Stores"])
@@ -286,11 +696,18 @@ def main():
             if camera_input is None and st.session_state.get('barcode_detected', False):
                 st.session_state.barcode_detected = False
                 st.session_state.product_info = None
+                st.session_state.photo_digest = None
                 st.rerun()
             
             if camera_input is not None:
-                image = cv2.imdecode(np.frombuffer(camera_input.getvalue(), np.uint8), cv2.IMREAD_COLOR)
-                barcode = scanner.process_frame(image)
+                # Every widget interaction reruns the script with the same photo,
+                # so only decode when the user has actually taken a new one
+                photo = camera_input.getvalue()
+                photo_digest = hashlib.blake2b(photo, digest_size=16).digest()
+                if photo_digest != st.session_state.photo_digest:
+                    st.session_state.photo_digest = photo_digest
+                    st.session_state.barcode = scanner.process_frame(scanner.decode_image(photo))
+                barcode = st.session_state.barcode
                 
                 if barcode:
                     st.session_state.barcode_detected = True
@@ -308,12 +725,18 @@ def main():
                 product_info = st.session_state.product_info
                 health_score = scanner.calculate_health_score(product_info)
                 
-                st.write("### Product Information")
-                st.write(f"**Product:** {product_info.get('product_name', 'Unknown')}")
-                st.write(f"**Brand:** {product_info.get('brands', 'Unknown Brand')}")
-                
                 score_color = 'red' if health_score < 50 else 'orange' if health_score < 70 else 'green'
-                st.markdown(f"**Health Score:** <span style='color:{score_color}'>{scanner.format_number(health_score)}/100</span>", unsafe_allow_html=True)
+                # One markdown element instead of one per line; the crowd-edited
+                # name and brand are escaped since the score span needs raw HTML
+                product_name = html.escape(str(product_info.get('product_name', 'Unknown')))
+                brand = html.escape(str(product_info.get('brands', 'Unknown Brand')))
+                st.markdown(
+                    "### Product Information\n\n"
+                    f"**Product:** {product_name}\n\n"
+                    f"**Brand:** {brand}\n\n"
+                    f"**Health Score:** <span style='color:{score_color}'>{scanner.format_number(health_score)}/100</span>",
+                    unsafe_allow_html=True
+                )
                 
                 if health_score < 70:
                     st.write("### 🥬 Healthier Alternatives")
@@ -325,71 +748,10 @@ def main():
                                 st.write(f"**Serving Size:** {alt['serving_size']}")
                                 
                                 st.write("**Nutrition Facts (For Whole Package):**")
-                                nutrients = alt['nutriments']
-                                for nutrient_key, label, unit in scanner.nutrition_facts_order:
-                                    if nutrient_key in nutrients and nutrients[nutrient_key] is not None:
-                                        try:
-                                            value = nutrients[nutrient_key]
-                                            if value == '' or value == 0:
-                                                continue
-                                            if unit == 'mg' and nutrient_key.endswith('_100g'):
-                                                value = float(value) * 1000
-                                            formatted_value = scanner.format_number(value)
-                                            st.write(f"- {label}: {formatted_value}{unit}")
-                                        except (ValueError, TypeError):
-                                            continue
+                                st.table(scanner.nutrition_facts_df(alt['nutriments']))
     
     with stores_tab:
-        st.write("### Find Stores with Healthy Alternatives")
-        product_name = ""
-        
-        if st.session_state.product_info:
-            product_name = st.session_state.product_info.get('product_name', '')
-        else:
-            product_name = st.text_input("Enter a product to find alternatives for:", "")
-        
-        if product_name:
-            find_stores = st.button("Find Stores")
-            
-            if find_stores:
-                # Create placeholder for results
-                results_placeholder = st.empty()
-                
-                # Show loading spinner outside try block
-                with st.spinner("🔍 Finding stores with healthy alternatives..."):
-                    try:
-                        import concurrent.futures
-                        
-                        def find_stores_with_timeout():
-                            return scanner.store_finder.find_stores(product_name)
-                        
-                        # Execute store finding with timeout
-                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                            future = executor.submit(find_stores_with_timeout)
-                            try:
-                                # Reduced timeout to 10 seconds for better user experience
-                                stores = future.result(timeout=10)
-                                
-                                # Clear previous results and display new ones
-                                with results_placeholder.container():
-                                    if stores:
-                                        for store in stores:
-                                            with st.expander(f"🏪 {store['name']}"):
-                                                st.write(f"**Why this store:** {store['description']}")
-                                                st.write("**Healthy Alternatives:**")
-                                                st.write(store['healthy_alternatives'])
-                                                st.write("**Special Features:**")
-                                                st.write(store['special_features'])
-                                    else:
-                                        st.info("No store recommendations available at the moment. Try again later.")
-                                
-                            except concurrent.futures.TimeoutError:
-                                with results_placeholder.container():
-                                    st.error("The store search is taking too long. Please try again.")
-                                
-                    except Exception as e:
-                        with results_placeholder.container():
-                            st.error(f"An error occurred while searching for stores: {str(e)}")
+        render_store_search(scanner)
 
 if __name__ == "__main__":
     main()